@@ -0,0 +1,86 @@
+# Fast validation and normalization of hostnames and MAC addresses: a
+# precompiled hostname validator, a MAC address parser to a canonical 48-bit
+# integer and memoized renderers for the formats used by ISC DHCPd and by
+# the FreeRADIUS database.
+#
+# Copyright (c) 2021-2022 Istituto Nazionale di Ricerca Metrologica <d.pilori@inrim.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# SPDX-License-Identifier: MIT
+
+import re
+import functools
+
+# Simple regex to validate a hostname
+_HOSTNAME_REGEX = re.compile(r'^(([a-zA-Z0-9]|[a-zA-Z0-9][a-zA-Z0-9\-]*[a-zA-Z0-9])\.)*([A-Za-z0-9]|[A-Za-z0-9][A-Za-z0-9\-]*[A-Za-z0-9])$')
+
+# Fast path for the most common MAC format: six 2-digit words separated by ':' or '-'
+_MAC_COMMON_REGEX = re.compile(r'[0-9A-Fa-f]{2}([:-])[0-9A-Fa-f]{2}(?:\1[0-9A-Fa-f]{2}){4}')
+
+# All the EUI-48 formats accepted by netaddr, with the bit width of each word
+_MAC_FORMATS = (
+    # 2 hex digits x 6 (UNIX, Windows, EUI-48)
+    (re.compile(':'.join(['([0-9A-Fa-f]{1,2})'] * 6)), 8),
+    (re.compile('-'.join(['([0-9A-Fa-f]{1,2})'] * 6)), 8),
+    # 4 hex digits x 3 (Cisco)
+    (re.compile(':'.join(['([0-9A-Fa-f]{1,4})'] * 3)), 16),
+    (re.compile('-'.join(['([0-9A-Fa-f]{1,4})'] * 3)), 16),
+    (re.compile(r'\.'.join(['([0-9A-Fa-f]{1,4})'] * 3)), 16),
+    # 6 hex digits x 2 (PostgreSQL)
+    (re.compile('-'.join(['([0-9A-Fa-f]{5,6})'] * 2)), 24),
+    (re.compile(':'.join(['([0-9A-Fa-f]{5,6})'] * 2)), 24),
+    # 12 hex digits (bare, no delimiters), or 11 with the leading zero dropped
+    (re.compile('([0-9A-Fa-f]{11,12})'), 48),
+)
+
+# Lowercase hex representation of every byte, to render MAC addresses
+_HEX_BYTES = ['{:02x}'.format(i) for i in range(256)]
+
+def is_valid_hostname(hostname):
+    """ Return True if the hostname is well-formed. """
+    return _HOSTNAME_REGEX.match(hostname) is not None
+
+def parse_mac(mac):
+    """ Parse a MAC address string, in any format accepted by netaddr.EUI, to a 48-bit integer. """
+    # Try first the usual XX:XX:XX:XX:XX:XX and XX-XX-XX-XX-XX-XX formats
+    match = _MAC_COMMON_REGEX.fullmatch(mac)
+    if match:
+        return int(mac.replace(match.group(1), ''), 16)
+
+    # Otherwise, go through all the supported formats
+    for regex, word_bits in _MAC_FORMATS:
+        match = regex.fullmatch(mac)
+        if match:
+            value = 0
+            for word in match.groups():
+                value = (value << word_bits) | int(word, 16)
+            return value
+
+    raise ValueError('Invalid MAC address: "{}".'.format(mac))
+
+@functools.lru_cache(maxsize=None)
+def mac_unix_expanded(mac):
+    """ Render a 48-bit MAC address in UNIX expanded format (xx:xx:xx:xx:xx:xx), as used by ISC DHCPd. """
+    return ':'.join([_HEX_BYTES[byte] for byte in mac.to_bytes(6, 'big')])
+
+@functools.lru_cache(maxsize=None)
+def mac_bare(mac):
+    """ Render a 48-bit MAC address in bare lowercase format (xxxxxxxxxxxx), as wanted by Aruba switches. """
+    return '{:012x}'.format(mac)
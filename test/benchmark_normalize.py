@@ -0,0 +1,95 @@
+# Micro-benchmark of MAC address normalization: netaddr.EUI vs normalize module.
+#
+# Copyright (c) 2021-2022 Istituto Nazionale di Ricerca Metrologica <d.pilori@inrim.it>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+# SPDX-License-Identifier: MIT
+
+import sys
+sys.path.append('../')
+
+import argparse
+import random
+import re
+import time
+import netaddr
+from normalize import is_valid_hostname, parse_mac, mac_unix_expanded, mac_bare
+
+# Uncompiled hostname regex, as previously used by the Vlan class
+_HOSTNAME_REGEX = r'^(([a-zA-Z0-9]|[a-zA-Z0-9][a-zA-Z0-9\-]*[a-zA-Z0-9])\.)*([A-Za-z0-9]|[A-Za-z0-9][A-Za-z0-9\-]*[A-Za-z0-9])$'
+
+def netaddr_path(macs, hostnames):
+    """ Validate and render every host as done with netaddr. """
+    for mac, hostname in zip(macs, hostnames):
+        re.search(_HOSTNAME_REGEX, hostname)
+        eui = netaddr.EUI(mac)
+        eui.dialect = netaddr.mac_unix_expanded
+        str(eui)
+        eui.format(dialect=netaddr.mac_bare).lower()
+
+def normalize_path(macs, hostnames):
+    """ Validate and render every host with the normalize module, starting from empty caches. """
+    mac_unix_expanded.cache_clear()
+    mac_bare.cache_clear()
+    for mac, hostname in zip(macs, hostnames):
+        is_valid_hostname(hostname)
+        mac = parse_mac(mac)
+        mac_unix_expanded(mac)
+        mac_bare(mac)
+
+def run(function, macs, hostnames, repeat):
+    """ Return the best wall-clock time of a function over several runs. """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(macs, hostnames)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+# Parse command line arguments
+cli_parser = argparse.ArgumentParser(description="Micro-benchmark of MAC address normalization.")
+cli_parser.add_argument("-n", "--number",
+                       help="Number of MAC addresses", type=int, default=100000)
+cli_parser.add_argument("-r", "--repeat",
+                       help="Number of runs (best one is reported)", type=int, default=3)
+args = cli_parser.parse_args()
+
+# Generate random MAC addresses, in the formats that may be typed in Google Sheets
+random.seed(0)
+dialects = [netaddr.mac_unix_expanded, netaddr.mac_eui48, netaddr.mac_cisco, netaddr.mac_bare]
+macs = list()
+hostnames = list()
+for i in range(args.number):
+    macs.append(str(netaddr.EUI(random.getrandbits(48), dialect=random.choice(dialects))))
+    hostnames.append('host-{}.example.org'.format(i))
+
+# Verify that both paths give the same result
+for mac in macs:
+    value = parse_mac(mac)
+    assert value == int(netaddr.EUI(mac))
+    assert mac_unix_expanded(value) == str(netaddr.EUI(mac, dialect=netaddr.mac_unix_expanded))
+    assert mac_bare(value) == netaddr.EUI(mac).format(dialect=netaddr.mac_bare).lower()
+
+time_netaddr = run(netaddr_path, macs, hostnames, args.repeat)
+time_normalize = run(normalize_path, macs, hostnames, args.repeat)
+print('{} addresses'.format(args.number))
+print('netaddr:   {:.3f} s'.format(time_netaddr))
+print('normalize: {:.3f} s'.format(time_normalize))
+print('speedup:   {:.1f}x'.format(time_netaddr / time_normalize))
@@ -26,7 +26,12 @@ import sys
 sys.path.append('../')
 
 import unittest
+import os
+import threading
+import fcntl
+import time
 from vlan import Vlan
+from normalize import is_valid_hostname, parse_mac, mac_unix_expanded, mac_bare
 import filecmp
 import json
 import mysql.connector
@@ -82,8 +87,58 @@ class TestVlan(unittest.TestCase):
         else:
             return False
 
+    def sync_concurrently(self, mysql_settings, vlan_first, vlan_second):
+        """ Sync vlan_second from another connection, while vlan_first is being synced and holds its locks. """
+        errors = list()
+        def sync_second():
+            try:
+                vlan_second.dump_to_radius_mysql(**mysql_settings, print_function=lambda message: None)
+            except Exception as exc:
+                errors.append(exc)
+        worker = threading.Thread(target=sync_second)
+
+        def start_worker(message):
+            # On the first change made by vlan_first, start the second sync and wait until it waits for a row lock
+            if worker.ident is not None:
+                return
+            worker.start()
+            cnx = mysql.connector.connect(**mysql_settings)
+            cur = cnx.cursor()
+            try:
+                deadline = time.monotonic() + 30
+                while worker.is_alive():
+                    cur.execute('SELECT COUNT(*) FROM information_schema.innodb_trx WHERE trx_state = "LOCK WAIT"')
+                    if cur.fetchall()[0][0] >= 1:
+                        break
+                    if time.monotonic() > deadline:
+                        raise Exception('The sync of VLAN {} is not waiting for a lock.'.format(vlan_second.vlan_id))
+                    time.sleep(0.05)
+            finally:
+                cur.close()
+                cnx.close()
+
+        vlan_first.dump_to_radius_mysql(**mysql_settings, print_function=start_worker)
+        self.assertIsNotNone(worker.ident, 'The sync of VLAN {} made no changes.'.format(vlan_first.vlan_id))
+        worker.join()
+        if errors:
+            raise errors[0]
+
+    def count_radius_rows(self, mysql_settings, mac):
+        """ Return the number of radcheck and radreply rows of a MAC address. """
+        cnx = mysql.connector.connect(**mysql_settings)
+        cur = cnx.cursor()
+        username = mac_bare(parse_mac(mac))
+        cur.execute('SELECT COUNT(*) FROM radcheck WHERE username = %s', (username, ))
+        radcheck_rows = cur.fetchall()[0][0]
+        cur.execute('SELECT COUNT(*) FROM radreply WHERE username = %s', (username, ))
+        radreply_rows = cur.fetchall()[0][0]
+        cur.close()
+        cnx.close()
+        return radcheck_rows, radreply_rows
+
     def test_dhcp_validation(self):
         """ Import a test vlan JSON and verify that the output DHCP config is correct. """
+        self.addCleanup(os.remove, 'test_vlan_unittest.conf.lock')
         vlan_test = Vlan(601, '10.61.0.0/24', 'VLAN_TEST', 'test_vlan_unittest.conf')
         vlan_test.generate_dhcp_config(json_in='test_vlan.json')
         vlan_test.dump_to_dhcpd()
@@ -148,6 +203,100 @@ class TestVlan(unittest.TestCase):
                 mysql_settings = json.load(f)
         vlan_test.dump_to_radius_mysql(**mysql_settings)
         self.assertTrue(self.compare_databases(mysql_settings, 'test_vlan_differentvlan.json', 701))
-    
+
+    def test_07_sql_locked_vlan(self):
+        """ Try to sync a VLAN while another process is syncing it. """
+        vlan_test = Vlan(701, '10.71.0.0/24', 'VLAN_TEST_2', 'test_vlan_unittest.conf')
+        vlan_test.generate_radius_config(json_in='test_vlan_removehost.json')
+        with open('test_mysql_settings.json', 'r') as f:
+                mysql_settings = json.load(f)
+        cnx = mysql.connector.connect(**mysql_settings)
+        cur = cnx.cursor()
+        cur.execute('SELECT GET_LOCK(%s, 0)', ('{}.radius_sync_vlan_701'.format(mysql_settings['database']), ))
+        cur.fetchall()
+        try:
+            with self.assertRaisesRegex(Exception, 'unable to lock VLAN 701'):
+                vlan_test.dump_to_radius_mysql(**mysql_settings, lock_timeout=0)
+        finally:
+            cur.close()
+            cnx.close()
+        self.assertTrue(self.compare_databases(mysql_settings, 'test_vlan_differentvlan.json', 701))
+
+    def test_08_sql_concurrent_move(self):
+        """ Move a host back to the first VLAN while the second VLAN, removing it, is being synced. """
+        vlan_from = Vlan(701, '10.71.0.0/24', 'VLAN_TEST_2', 'test_vlan_unittest.conf')
+        vlan_from.generate_radius_config(json_in='test_vlan_concurrent.json')
+        vlan_to = Vlan(601, '10.61.0.0/24', 'VLAN_TEST', 'test_vlan_unittest.conf')
+        vlan_to.generate_radius_config(json_in='test_vlan_addhost.json')
+        with open('test_mysql_settings.json', 'r') as f:
+                mysql_settings = json.load(f)
+
+        self.sync_concurrently(mysql_settings, vlan_from, vlan_to)
+        self.assertTrue(self.compare_databases(mysql_settings, 'test_vlan_concurrent.json', 701))
+        self.assertTrue(self.compare_databases(mysql_settings, 'test_vlan_addhost.json', 601))
+        self.assertEqual(self.count_radius_rows(mysql_settings, '00:A0:03:1E:95:E8'), (1, 2))
+
+    def test_09_sql_concurrent_stale_host(self):
+        """ Sync the first VLAN, with an unchanged host, while the second VLAN is moving this host away. """
+        vlan_from = Vlan(701, '10.71.0.0/24', 'VLAN_TEST_2', 'test_vlan_unittest.conf')
+        vlan_from.generate_radius_config(json_in='test_vlan_differentvlan.json')
+        vlan_to = Vlan(601, '10.61.0.0/24', 'VLAN_TEST', 'test_vlan_unittest.conf')
+        vlan_to.generate_radius_config(json_in='test_vlan_addhost.json')
+        with open('test_mysql_settings.json', 'r') as f:
+                mysql_settings = json.load(f)
+
+        # VLAN 601 must see that the host has been moved to VLAN 701, and move it back
+        self.sync_concurrently(mysql_settings, vlan_from, vlan_to)
+        self.assertTrue(self.compare_databases(mysql_settings, 'test_vlan_addhost.json', 601))
+        self.assertEqual(self.count_radius_rows(mysql_settings, '00:A0:03:1E:95:E8'), (1, 2))
+        self.assertEqual(self.count_radius_rows(mysql_settings, '00:A0:03:20:A6:BD'), (0, 0))
+
+    def test_10_dhcp_locked_file(self):
+        """ Try to write a DHCP config while another process is writing it. """
+        self.addCleanup(os.remove, 'test_vlan_locked.conf')
+        self.addCleanup(os.remove, 'test_vlan_locked.conf.lock')
+        vlan_test = Vlan(601, '10.61.0.0/24', 'VLAN_TEST', 'test_vlan_locked.conf')
+        vlan_test.generate_dhcp_config(json_in='test_vlan.json')
+        with open('test_vlan_locked.conf', 'w') as f:
+            f.write('# Old config\n')
+        with open('test_vlan_locked.conf.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            start = time.monotonic()
+            with self.assertRaisesRegex(Exception, 'unable to lock VLAN 601'):
+                vlan_test.dump_to_dhcpd(lock_timeout=1)
+            self.assertGreaterEqual(time.monotonic() - start, 1)
+        with open('test_vlan_locked.conf', 'r') as f:
+            self.assertEqual(f.read(), '# Old config\n')
+
+        # Once the lock is released, the config is written
+        vlan_test.dump_to_dhcpd(lock_timeout=1)
+        self.assertTrue(filecmp.cmp('test_vlan_locked.conf', 'test_vlan.conf'))
+
+class TestNormalize(unittest.TestCase):
+    def test_parse_mac_formats(self):
+        """ Verify that every MAC format accepted by netaddr is parsed to the same value. """
+        for mac in ['00:A0:03:1E:95:E8', '00-a0-03-1e-95-e8', '0:a0:3:1e:95:e8', '00a0.031e.95e8',
+                    '00a0:031e:95e8', 'a0-31e-95e8', '00a003-1e95e8', '0a003:1e95e8', '00a0031e95e8', '0a0031e95e8']:
+            self.assertEqual(parse_mac(mac), int(netaddr.EUI(mac)))
+
+    def test_parse_mac_invalid(self):
+        """ Verify that malformed MAC addresses are rejected. """
+        for mac in ['', '00:A0:03:1E:95', '00:A0-03:1E:95:E8', '00:A0:03:1E:95:G8', '00:A0:03:1E:95:E8:00', '0x00a0031e95e8']:
+            with self.assertRaises(ValueError):
+                parse_mac(mac)
+
+    def test_render_mac(self):
+        """ Verify that MAC addresses are rendered as netaddr does. """
+        mac = netaddr.EUI('00:A0:03:1E:95:E8')
+        self.assertEqual(mac_unix_expanded(int(mac)), format(netaddr.EUI(mac, dialect=netaddr.mac_unix_expanded)))
+        self.assertEqual(mac_bare(int(mac)), mac.format(dialect=netaddr.mac_bare).lower())
+
+    def test_hostname_validation(self):
+        """ Verify hostname validation. """
+        self.assertTrue(is_valid_hostname('test-1'))
+        self.assertTrue(is_valid_hostname('test-1.inrim.it'))
+        self.assertFalse(is_valid_hostname('-test'))
+        self.assertFalse(is_valid_hostname('test_1'))
+
 if __name__ == '__main__':
     unittest.main()
@@ -26,14 +26,30 @@
 
 import gspread
 import json
-import re
-import netaddr
 import ipaddress
 import os.path
+import fcntl
+import time
 import mysql.connector
+from normalize import is_valid_hostname, parse_mac, mac_unix_expanded, mac_bare
 
-# Simple regex to validate a hostname
-_HOSTNAME_REGEX = '^(([a-zA-Z0-9]|[a-zA-Z0-9][a-zA-Z0-9\-]*[a-zA-Z0-9])\.)*([A-Za-z0-9]|[A-Za-z0-9][A-Za-z0-9\-]*[A-Za-z0-9])$'
+# Seconds between two attempts to lock a file
+_LOCK_POLL_INTERVAL = 0.1
+
+def _lock_file(path, timeout):
+    """ Open a file and lock it exclusively, waiting up to timeout seconds (negative: forever).
+        Return the open file, or None if the file is still locked by another process. """
+    lock_file = open(path, 'w')
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return lock_file
+        except BlockingIOError:
+            if timeout >= 0 and time.monotonic() >= deadline:
+                lock_file.close()
+                return None
+            time.sleep(_LOCK_POLL_INTERVAL)
 
 class Vlan:
     """ Basic class to define a single VLAN, loading all the settings. """
@@ -135,16 +151,15 @@ class Vlan:
             if not (hostname and mac and ipv4):
                 continue
          
-            # Validate and transform MAC address to UNIX extended format (XX:XX:XX:XX:XX:XX)
-            mac = netaddr.EUI(mac)
-            mac.dialect = netaddr.mac_unix_expanded
+            # Validate and transform MAC address to a 48-bit integer
+            mac = parse_mac(mac)
             if mac not in mac_set:
                 mac_set.add(mac)
             else:
                 raise Exception('DHCP config: Duplicated MAC addess')
             
             # Validate hostname
-            if not re.search(_HOSTNAME_REGEX, hostname):
+            if not is_valid_hostname(hostname):
                 raise Exception('DHCP config: {} is not a well-formed hostname.'.format(hostname))
                 
             # Validate IPv4 address
@@ -169,8 +184,9 @@ class Vlan:
                                'room': room,
                                'description': description})
 
-    def dump_to_dhcpd(self, out_dir=''):
-        """ Dump configuration to a DHCPd configuration file """
+    def dump_to_dhcpd(self, out_dir='', lock_timeout=600):
+        """ Dump configuration to a DHCPd configuration file.
+            If another process is writing the same file, wait up to lock_timeout seconds (negative: forever). """
         if not self.dhcp_config:
             raise Exception('No DHCP config. Please run generate_dhcp_config() to generate a config.')
             
@@ -180,13 +196,18 @@ class Vlan:
         else:
             out_file = self.dhcpd_out_file
   
-        with open(out_file, 'w') as f:
+        # Lock the output file, so that concurrent processes never write it at once.
+        # The lock is released when the lock file is closed.
+        lock_file = _lock_file(out_file + '.lock', lock_timeout)
+        if lock_file is None:
+            raise Exception('DHCP config: unable to lock VLAN {}, another sync may be running.'.format(self.vlan_id))
+        with lock_file, open(out_file, 'w') as f:
             for host in self.dhcp_config:      
                 # Generate DHCPd configuration
                 f.write('# {} [{}]\n# {}, {}\n'.format(host['responsible'], host['room'], host['oss'], host['description']))
                 if host['comments']:    
                     f.write('# {}\n'.format(host['comments']))
-                f.write('host {} {{\n  hardware ethernet {};\n  fixed-address {};\n}}\n\n'.format(host['hostname'], host['mac'],
+                f.write('host {} {{\n  hardware ethernet {};\n  fixed-address {};\n}}\n\n'.format(host['hostname'], mac_unix_expanded(host['mac']),
                         host['ipv4']))                               
 
     def generate_radius_config(self, json_in='', mark_errors=False):
@@ -218,7 +239,7 @@ class Vlan:
                 continue
             
             # Validate and store MAC address
-            mac = netaddr.EUI(mac)
+            mac = parse_mac(mac)
             if mac not in mac_set:
                 mac_set.add(mac)
             else:
@@ -248,8 +269,9 @@ class Vlan:
             self.radius_config.append({'mac': mac,
                                'ipv4': ipv4})   
     
-    def dump_to_radius_mysql(self, user, password, host, database, print_function=print):
-        """ Dump the valudated set of MAC addresses to the MySQL FreeRADIUS database. """                           
+    def dump_to_radius_mysql(self, user, password, host, database, print_function=print, lock_timeout=600):
+        """ Dump the valudated set of MAC addresses to the MySQL FreeRADIUS database.
+            If another process is syncing the same VLAN, wait up to lock_timeout seconds (negative: forever). """
         if not self.radius_config:
             raise Exception('No RADIUS config. Please run generate_radius_config() to generate a valid config.')
     
@@ -259,6 +281,50 @@ class Vlan:
                                   database=database)
         cur = cnx.cursor()
 
+        # Read committed data only and lock only the rows actually read, so that
+        # syncs of different VLANs never wait on each other for unrelated hosts
+        cur.execute('SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED')
+
+        # Acquire a per-VLAN lock, so that concurrent processes never sync the same VLAN at once.
+        # The lock is held by the MySQL session, so it is also released if the connection is closed.
+        # GET_LOCK names are global to the MySQL server, so include the database name.
+        lock_name = '{}.radius_sync_vlan_{}'.format(database, self.vlan_id)
+        cur.execute('SELECT GET_LOCK(%s, %s)', (lock_name, lock_timeout))
+        lock_acquired = cur.fetchall()[0][0]
+        if lock_acquired != 1:
+            cur.close()
+            cnx.close()
+            raise Exception('RADIUS sync: unable to lock VLAN {}, another sync may be running.'.format(self.vlan_id))
+
+        try:
+            self._sync_radius(cur, print_function)
+
+            # Commit all changes and release the lock
+            cnx.commit()
+            cur.execute('SELECT RELEASE_LOCK(%s)', (lock_name, ))
+            cur.fetchall()
+        finally:
+            # Close all
+            cur.close()
+            cnx.close()
+
+    def _sync_radius(self, cur, print_function):
+        """ Add, update and remove the hosts of the VLAN in the FreeRADIUS database, without committing. """
+        # Before reading anything, lock the hosts in Google Sheets and the hosts currently on this VLAN:
+        # a concurrent sync of another VLAN (e.g. moving one of these hosts) either commits before
+        # the hosts are read below, or waits until this one is committed.
+        # All the radcheck rows are locked in a single statement, before any radreply row is changed,
+        # so that concurrent syncs always acquire their locks in the same order.
+        usernames = [mac_bare(host['mac']) for host in self.radius_config]
+        cur.execute(('SELECT id FROM radcheck '
+                     'WHERE username IN ({}) '
+                     'OR username IN ( '
+                     '    SELECT username FROM radreply '
+                     '    WHERE value = %s AND attribute = "Tunnel-Private-Group-ID" '
+                     ') FOR UPDATE').format(', '.join(['%s'] * len(usernames))),
+                    usernames + [self.vlan_id])
+        cur.fetchall()
+
         # Get list of Mac-IP for the current VLAN
         cur.execute(('SELECT radcheck.username, radreply.value '
 	                 ' FROM radcheck '
@@ -277,12 +343,13 @@ class Vlan:
         current_macs = set()
         ip_bindings = dict()
         for (mac, ipv4) in cur:
-            current_macs.add(netaddr.EUI(mac))
+            mac = parse_mac(mac)
+            current_macs.add(mac)
             # Verify if an IPv4 is given or not
             if ipv4:
-                ip_bindings[netaddr.EUI(mac)] = ipaddress.ip_address(ipv4)
+                ip_bindings[mac] = ipaddress.ip_address(ipv4)
             else:
-                ip_bindings[netaddr.EUI(mac)] = None
+                ip_bindings[mac] = None
 
         # Now process every content in Google Sheets, adding/removing it from the database
         for host in self.radius_config:
@@ -290,7 +357,7 @@ class Vlan:
             mac, ipv4 = host['mac'], host['ipv4']
 
             # Format MAC address as wanted by Aruba switches
-            mac_format = mac.format(dialect=netaddr.mac_bare).lower()
+            mac_format = mac_bare(mac)
 
             # First of all, check if the Mac already exists
             if mac in current_macs:
@@ -302,22 +369,25 @@ class Vlan:
                     continue
                 else:
                     # Otherwise, fix IP binding
-                    cur.execute(('DELETE FROM radreply WHERE username = %s AND attribute = "Framed-IP-Address"'),
-                               (mac_format,))
+                    cur.execute(('DELETE radreply FROM radreply '
+                                 'INNER JOIN radreply AS vlan ON vlan.username = radreply.username '
+                                 'WHERE radreply.username = %s AND radreply.attribute = "Framed-IP-Address" '
+                                 'AND vlan.attribute = "Tunnel-Private-Group-ID" AND vlan.value = %s'),
+                               (mac_format, self.vlan_id))
 
                     if ipv4:
                         cur.execute(('INSERT INTO radreply '
                             '(username, attribute, op, value) '
                             'VALUES (%s, %s, %s, %s)'),
                             (mac_format, 'Framed-IP-Address', ':=', format(ipv4)))
-                        print_function('Setting new IPv4 address of host "{}": {}...'.format(mac, ipv4))
+                        print_function('Setting new IPv4 address of host "{}": {}...'.format(mac_unix_expanded(mac), ipv4))
             
             # Mac is not present in this VLAN: add a new record
             else:
                 # Check if host is currently present on a different VLAN, and, if so, remove it
                 cur.execute(('DELETE FROM radcheck WHERE username = %s'), (mac_format,))
                 if cur.rowcount >= 1:
-                    print_function('Host "{}" is already present on a different VLAN; removing it...'.format(mac))
+                    print_function('Host "{}" is already present on a different VLAN; removing it...'.format(mac_unix_expanded(mac)))
                 cur.execute(('DELETE FROM radreply WHERE username = %s'),
                     (mac_format, ))
 
@@ -341,19 +411,17 @@ class Vlan:
 
                 # Print what is done
                 if cur.rowcount >= 1:
-                    print_function('Adding host {} to VLAN {}...'.format(mac, self.vlan_id))
+                    print_function('Adding host {} to VLAN {}...'.format(mac_unix_expanded(mac), self.vlan_id))
 
         # Now remove all old MAC addresses
         for mac in current_macs:
-            mac_format = mac.format(dialect=netaddr.mac_bare).lower()
-            cur.execute(('DELETE FROM radcheck WHERE username = %s'), (mac_format,))
+            mac_format = mac_bare(mac)
+            # Only remove the rows still tagged with this VLAN
+            cur.execute(('DELETE radcheck, radreply FROM radcheck '
+                         'INNER JOIN radreply AS vlan ON vlan.username = radcheck.username '
+                         'LEFT JOIN radreply ON radreply.username = radcheck.username '
+                         'WHERE radcheck.username = %s '
+                         'AND vlan.attribute = "Tunnel-Private-Group-ID" AND vlan.value = %s'),
+                        (mac_format, self.vlan_id))
             if cur.rowcount >= 1:
-                print_function('Removing host {} from VLAN {}...'.format(mac, self.vlan_id))
-            cur.execute(('DELETE FROM radreply WHERE username = %s'), (mac_format,))
-    
-        # Commit all changes
-        cnx.commit()
-
-        # Close all
-        cur.close()
-        cnx.close()
+                print_function('Removing host {} from VLAN {}...'.format(mac_unix_expanded(mac), self.vlan_id))
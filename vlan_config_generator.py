@@ -53,6 +53,8 @@ cli_parser.add_argument("-v", "--verbose",
                        help="Be verbose.", action='store_true')
 cli_parser.add_argument("--specific-vlans",
                        help="Process only a list of VLANs (space separated).", metavar='VLAN_ID', nargs='+', type=int)                                       
+cli_parser.add_argument("--lock-timeout",
+                       help="Seconds to wait for other processes syncing the same VLAN (default: 600).", metavar='SECONDS', type=int, default=600)
 args = cli_parser.parse_args()
 
 # Set up logging
@@ -90,7 +92,7 @@ for v in list_vlan:
     if args.dhcp:
         try:
             v.generate_dhcp_config()
-            v.dump_to_dhcpd(out_dir=args.output_dir)
+            v.dump_to_dhcpd(out_dir=args.output_dir, lock_timeout=args.lock_timeout)
             vlan_logger.info('Successfully generated DHCP config for VLAN {}'.format(v.vlan_id))
         except Exception as exc:
             vlan_logger.error('Skipping ISC DHCP config of VLAN {} due to {} error: "{}".'.format(v.vlan_id, type(exc).__name__, exc))
@@ -101,7 +103,7 @@ for v in list_vlan:
             v.generate_radius_config(mark_errors=True)
             with open(args.mysql_settings, 'r') as f:
                 mysql_settings = json.load(f)
-            v.dump_to_radius_mysql(**mysql_settings, print_function=vlan_logger.info)
+            v.dump_to_radius_mysql(**mysql_settings, print_function=vlan_logger.info, lock_timeout=args.lock_timeout)
             vlan_logger.info('Successfully synchronized RADIUS db for VLAN {}'.format(v.vlan_id))
         except Exception as exc:
             vlan_logger.error('Skipping RADIUS database sync of VLAN {} due to {} error: "{}".'.format(v.vlan_id, type(exc).__name__, exc))